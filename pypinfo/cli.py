@@ -1,5 +1,5 @@
 from decimal import ROUND_UP, Decimal
-from typing import List
+from typing import TYPE_CHECKING, List
 
 import click
 from binary import TEBIBYTE, convert_units
@@ -42,6 +42,9 @@ from pypinfo.fields import (
     LibcVersion,
 )
 
+if TYPE_CHECKING:
+    from google.cloud.bigquery.query import ScalarQueryParameter
+
 CONTEXT_SETTINGS = {
     'help_option_names': ('-h', '--help'),
     'max_content_width': 300,
@@ -89,7 +92,7 @@ TO_CENTS = Decimal('0.00')
 @click.option('--start-date', '-sd', help='Must be negative or YYYY-MM[-DD]. Default: -31')
 @click.option('--end-date', '-ed', help='Must be negative or YYYY-MM[-DD]. Default: -1')
 @click.option('--month', '-m', help='Shortcut for -sd & -ed for a single YYYY-MM month.')
-@click.option('--where', '-w', help='WHERE conditional. Default: file.project = "project"')
+@click.option('--where', '-w', help='Extra WHERE conditional, combined with the project and installer filters.')
 @click.option('--order', '-o', help='Field to order by. Default: download_count')
 @click.option('--all', 'all_installers', is_flag=True, help='Show downloads by all installers, not only pip.')
 @click.option('--percent', '-pc', is_flag=True, help='Print percentages.')
@@ -152,6 +155,7 @@ def pypinfo(
     if month:
         start_date, end_date = month_ends(month)
 
+    query_parameters: List['ScalarQueryParameter'] = []
     built_query = build_query(
         project,
         parsed_fields,
@@ -162,11 +166,13 @@ def pypinfo(
         where=where,
         order=order_name,
         pip=not all_installers,
+        # --test prints a query that can be run as is, without parameters
+        query_parameters=query_parameters if run else None,
     )
 
     if run:
         with create_client(get_credentials()) as client:
-            query_job = client.query(built_query, job_config=create_config())
+            query_job = client.query(built_query, job_config=create_config(query_parameters))
             query_rows = query_job.result(timeout=timeout // 1000)
             rows = parse_query_result(query_rows)
 
@@ -1,19 +1,32 @@
 import calendar
 import json
 import os
+import re
 from datetime import date, datetime
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from functools import lru_cache
+from io import StringIO
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
-from google.cloud.bigquery import Client
-from google.cloud.bigquery.job import QueryJobConfig
-from google.cloud.bigquery.table import RowIterator
 from packaging.utils import canonicalize_name
 from packaging.requirements import Requirement
 from packaging.specifiers import SpecifierSet, Specifier
 from packaging.version import Version
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
 from pypinfo.fields import AGGREGATES, Downloads, Field
 
+if TYPE_CHECKING:
+    # google.cloud.bigquery is slow to import, it is only loaded when a query runs
+    from google.cloud.bigquery import Client
+    from google.cloud.bigquery.job import QueryJobConfig
+    from google.cloud.bigquery.query import ScalarQueryParameter
+    from google.cloud.bigquery.table import RowIterator
+
 FROM = 'FROM `bigquery-public-data.pypi.file_downloads`'
 DATE_ADD = 'TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL {} DAY)'
 START_TIMESTAMP = 'TIMESTAMP("{} 00:00:00")'
@@ -21,13 +34,22 @@ END_TIMESTAMP = 'TIMESTAMP("{} 23:59:59")'
 START_DATE = '-31'
 END_DATE = '-1'
 DEFAULT_LIMIT = 10
+TOTAL = 'Total'
+# -n or yyyy-mm-dd, the exact values are checked by int() and strptime, -n
+# allows what int() does, like surrounding whitespace and digit separators
+DATE_PATTERN = re.compile(r'(?P<days>\s*-[\d_]+\s*)|[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}')
 
 Rows = List[List[str]]
 
+_canonicalize_name = lru_cache(maxsize=1024)(canonicalize_name)
+
+
+def create_config(query_parameters: Sequence['ScalarQueryParameter'] = ()) -> 'QueryJobConfig':
+    from google.cloud.bigquery.job import QueryJobConfig
 
-def create_config() -> QueryJobConfig:
     config = QueryJobConfig()
     config.use_legacy_sql = False
+    config.query_parameters = list(query_parameters)
     return config
 
 
@@ -48,31 +70,43 @@ def normalize_dates(start_date: str, end_date: str) -> Tuple[str, str]:
     return start_date, end_date
 
 
-def create_client(creds_file: Optional[str] = None) -> Client:
+def create_client(creds_file: Optional[str] = None) -> 'Client':
+    from google.cloud.bigquery import Client
+
     creds_file = creds_file or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
 
     if creds_file is None:
         raise SystemError('Credentials could not be found.')
 
-    with open(creds_file, encoding="UTF-8") as file:
-        creds = json.load(file)
-    project = creds['project_id']
+    project = read_project_id(creds_file)
     return Client.from_service_account_json(creds_file, project=project)
 
 
+def read_project_id(creds_file: str) -> str:
+    """Return the project_id of a credentials file, cached until its mtime changes"""
+    return _read_project_id(creds_file, os.path.getmtime(creds_file))
+
+
+@lru_cache(maxsize=16)
+def _read_project_id(creds_file: str, mtime: float) -> str:
+    # mtime is only part of the cache key
+    with open(creds_file, 'rb') as file:
+        project: str = json.load(file)['project_id']
+    return project
+
+
 def validate_date(date_text: str) -> bool:
     """Return True if valid, raise ValueError if not"""
-    try:
-        if int(date_text) < 0:
-            return True
-    except ValueError:
-        pass
-
-    try:
-        datetime.strptime(date_text, '%Y-%m-%d')
-        return True
-    except ValueError:
-        pass
+    match = DATE_PATTERN.fullmatch(date_text)
+    if match is not None:
+        try:
+            if match.group('days') is None:
+                datetime.strptime(date_text, '%Y-%m-%d')
+                return True
+            if int(date_text) < 0:
+                return True
+        except ValueError:
+            pass
 
     raise ValueError('Dates must be negative integers or YYYY-MM[-DD] in the past.')
 
@@ -85,6 +119,7 @@ def format_date(date: str, timestamp_format: str) -> str:
     return date
 
 
+@lru_cache(maxsize=256)
 def month_ends(yyyy_mm: str) -> Tuple[str, str]:
     """Helper to return start_date and end_date of a month as yyyy-mm-dd"""
     year, month = map(int, yyyy_mm.split("-"))
@@ -164,17 +199,8 @@ def version_specifier_condition(specifier: Specifier) -> str:
     raise ValueError(f'operator not supported: {specifier}')
 
 
-def build_query(
-    project: str,
-    all_fields: Iterable[Field],
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    days: Optional[int] = None,
-    limit: Optional[int] = None,
-    where: Optional[str] = None,
-    order: Optional[str] = None,
-    pip: bool = False,
-) -> str:
+def parse_project(project: str) -> Tuple[str, SpecifierSet]:
+    """Split a project requirement into its canonical name and version specifiers"""
     project_specifiers = SpecifierSet()
     if project:
         req = Requirement(project)
@@ -187,7 +213,26 @@ def build_query(
         project = req.name
         project_specifiers = req.specifier
 
-    project = canonicalize_name(project)
+    return _canonicalize_name(project), project_specifiers
+
+
+def build_query(
+    project: str,
+    all_fields: Iterable[Field],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    days: Optional[int] = None,
+    limit: Optional[int] = None,
+    where: Optional[str] = None,
+    order: Optional[str] = None,
+    pip: bool = False,
+    query_parameters: Optional[List['ScalarQueryParameter']] = None,
+) -> str:
+    """Return the query for project. If a query_parameters list is given, the project
+    is referenced as @project and its value is appended to the list instead of
+    being written into the query.
+    """
+    project, project_specifiers = parse_project(project)
 
     start_date = start_date or START_DATE
     end_date = end_date or END_DATE
@@ -218,73 +263,71 @@ def build_query(
     fields = list(dict.fromkeys(all_fields))
 
     fields.append(Downloads)
-    query = 'SELECT\n'
-
-    for field in fields:
-        query += f'  {field.data} as {field.name},\n'
-
-    query += f'{FROM}\n'
+    select = ''.join(f'  {field.data} as {field.name},\n' for field in fields)
+    parts = [f'SELECT\n{select}{FROM}\n']
 
+    # The table is partitioned by timestamp, keep the range first and compare
+    # the already canonical project name as is, wrapping the column in a
+    # function like LOWER() would prevent BigQuery from pruning on it
     conditions = [f'WHERE timestamp BETWEEN {start_date} AND {end_date}\n']
     if project:
-        conditions.append(f'file.project = "{project}"\n')
+        if query_parameters is None:
+            conditions.append(f'file.project = "{project}"\n')
+        else:
+            from google.cloud.bigquery.query import ScalarQueryParameter
+
+            query_parameters.append(ScalarQueryParameter('project', 'STRING', project))
+            conditions.append('file.project = @project\n')
     for specifier in project_specifiers:
         conditions.append(version_specifier_condition(Specifier(str(specifier))))
     if pip:
         conditions.append('details.installer.name = "pip"\n')
-    query += '  AND '.join(conditions)
+    parts.append('  AND '.join(conditions))
     if where:
-        query += f'  AND {where}\n'
+        parts.append(f'  AND {where}\n')
 
     non_aggregate_fields = [field.name for field in fields if field not in AGGREGATES]
     if non_aggregate_fields:
-        query += 'GROUP BY\n'
-        query += '  '
-        query += ', '.join(non_aggregate_fields)
-        query += '\n'
+        parts.append(f'GROUP BY\n  {", ".join(non_aggregate_fields)}\n')
 
-    query += f'ORDER BY\n  {order or Downloads.name} DESC\n'
-    query += f'LIMIT {limit}'
+    parts.append(f'ORDER BY\n  {order or Downloads.name} DESC\nLIMIT {limit}')
 
-    return query
+    return ''.join(parts)
 
 
-def parse_query_result(query_rows: RowIterator) -> Rows:
-    rows = [[field.name for field in query_rows.schema]]
-    rows.extend([str(item) for item in row] for row in query_rows)
-    return rows
+def parse_query_result(query_rows: 'RowIterator') -> Rows:
+    headers = [field.name for field in query_rows.schema]
+    return [headers, *([str(item) for item in row] for row in query_rows)]
 
 
 def add_percentages(rows: Rows, include_sign: bool = True) -> Rows:
 
-    headers = rows.pop(0)
+    headers, *data_rows = rows
     index = headers.index('download_count')
     headers.insert(index, 'percent')
-    total_downloads = sum(int(row[index]) for row in rows)
-    percent_format = '{:.2%}' if include_sign else '{:.2}'
+    downloads = [int(row[index]) for row in data_rows]
+    # Avoid dividing by zero when no downloads were returned
+    total_downloads = sum(downloads) or 1
+    percent_format = ('{:.2%}' if include_sign else '{:.2}').format
 
-    for row in rows:
-        percent = percent_format.format(int(row[index]) / total_downloads)
-        row.insert(index, percent)
+    for row, count in zip(data_rows, downloads):
+        row.insert(index, percent_format(count / total_downloads))
 
-    rows.insert(0, headers)
     return rows
 
 
 def get_download_total(rows: Rows) -> Tuple[int, int]:
     """Return the total downloads, and the downloads column"""
-    headers = rows.pop(0)
-    index = headers.index('download_count')
-    total_downloads = sum(int(row[index]) for row in rows)
+    index = rows[0].index('download_count')
+    total_downloads = sum(int(row[index]) for row in islice(rows, 1, None))
 
-    rows.insert(0, headers)
     return total_downloads, index
 
 
 def add_download_total(rows: Rows) -> Rows:
     """Add a final row to rows showing the total downloads"""
     total_row = [""] * len(rows[0])
-    total_row[0] = "Total"
+    total_row[0] = TOTAL
     total_downloads, downloads_column = get_download_total(rows)
     total_row[downloads_column] = str(total_downloads)
     rows.append(total_row)
@@ -292,71 +335,102 @@ def add_download_total(rows: Rows) -> Rows:
     return rows
 
 
-def tabulate(rows: Rows, markdown: bool = False) -> str:
-    column_widths = [0] * len(rows[0])
-    right_align = [[False] * len(rows[0])] * len(rows)
-
-    # Get max width of each column
-    for r, row in enumerate(rows):
-        for i, item in enumerate(row):
-            if item.isdigit():
-                # Separate the thousands
-                rows[r][i] = f"{int(item):,}"
-                right_align[r][i] = True
-            elif item.endswith('%'):
-                right_align[r][i] = True
-            length = len(item)
-            if length > column_widths[i]:
-                column_widths[i] = length
-
-    tabulated = '| '
-
-    headers = rows.pop(0)
-    for i, item in enumerate(headers):
-        tabulated += item + ' ' * (column_widths[i] - len(item) + 1) + '| '
-
-    tabulated = tabulated.rstrip()
-    tabulated += '\n| '
-
-    for i in range(len(rows[0])):
-        tabulated += '-' * (column_widths[i] - 1)
-        if right_align[0][i] and markdown:
-            tabulated += ': | '
-        else:
-            tabulated += '- | '
+def numeric_columns(rows: Rows) -> List[bool]:
+    """Return whether each column has data and holds integers in all of its non-empty
+    data cells
+    """
+    headers, *data_rows = rows
+    numeric = []
+    for column in zip(*data_rows):
+        # Empty cells add nothing, isascii rules out unicode digits int() rejects
+        joined = ''.join(column)
+        numeric.append(joined.isascii() and joined.isdigit())
+    return numeric or [False] * len(headers)
 
-    tabulated = tabulated.rstrip()
-    tabulated += '\n'
 
-    for r, row in enumerate(rows):
-        for i, item in enumerate(row):
-            num_spaces = column_widths[i] - len(item)
-            tabulated += '| '
-            if right_align[r][i]:
-                tabulated += ' ' * num_spaces + item + ' '
-            else:
-                tabulated += item + ' ' * (num_spaces + 1)
-        tabulated += '|\n'
+def tabulate(rows: Rows, markdown: bool = False) -> str:
+    headers = rows[0]
+    # The row added by add_download_total does not decide which columns are numeric
+    has_total = len(rows) > 1 and rows[-1][0] == TOTAL
+    numeric = numeric_columns(rows[:-1] if has_total else rows)
+
+    column_widths = []
+    right_align = []
+    # Pad every cell of a column at once, rows are joined afterwards
+    padded_columns = []
+    for (header, *cells), is_numeric in zip(zip(*rows), numeric):
+        if is_numeric:
+            # Separate the thousands
+            cells = [f"{int(cell):,}" if cell.isdigit() else cell for cell in cells]
+            right = any(cells)
+        else:
+            right = any(cell.endswith('%') for cell in cells)
+        width = max(len(header), max(map(len, cells), default=0))
+        pad = str.rjust if right else str.ljust
+        column_widths.append(width)
+        right_align.append(right)
+        padded_columns.append([f'| {pad(cell, width)} ' for cell in cells])
+
+    tabulated = [f'| {header.ljust(width)} ' for header, width in zip(headers, column_widths)]
+    tabulated.append('|\n')
+    for width, right in zip(column_widths, right_align):
+        tabulated.append(f'| {"-" * (width - 1)}{":" if right and markdown else "-"} ')
+    tabulated.append('|\n')
+
+    for padded_row in zip(*padded_columns):
+        tabulated.extend(padded_row)
+        tabulated.append('|\n')
+
+    return ''.join(tabulated)
+
+
+def dump_json(obj: Any, indent: Optional[int] = None) -> str:
+    """Serialize obj with sorted keys, compact unless indent is given"""
+    # orjson only supports compact or 2-space indented output
+    if orjson is not None and indent in (None, 2):
+        option = orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode()
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits, which json supports
 
-    return tabulated
+    separators = (',', ':') if indent is None else None
+    return json.dumps(obj, indent=indent, separators=separators, sort_keys=True)
 
 
 def format_json(rows: Rows, query_info: Dict[str, Any], indent: Optional[int]) -> str:
-    headers, *_data = rows
-    data: List[Any] = _data
-    items: List[Dict[str, Any]] = []
-
-    for d in data:
-        item: Dict[str, Any] = {}
-        for i in range(len(headers)):
-            if d[i].isdigit():
-                d[i] = int(d[i])
-            item[headers[i]] = d[i]
-        items.append(item)
+    headers, *data = rows
+    columns: List[Sequence[Any]] = []
+    for column, is_numeric in zip(zip(*data), numeric_columns(rows)):
+        if not is_numeric:
+            columns.append(column)
+        elif all(column):
+            columns.append(list(map(int, column)))
+        else:
+            columns.append([int(cell) if cell else cell for cell in column])
+    items = (dict(zip(headers, row)) for row in zip(*columns))
 
     now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
 
-    j = {'last_update': now, 'rows': items, 'query': query_info}
-
-    separators = (',', ':') if indent is None else None
-    return json.dumps(j, indent=indent, separators=separators, sort_keys=True)
+    # Per row calls only pay off with orjson, json encodes the whole document faster
+    if indent is not None or orjson is None:
+        return dump_json({'last_update': now, 'rows': list(items), 'query': query_info}, indent)
+
+    # Compact output is encoded one row at a time rather than as a single
+    # document, top level keys are written in sorted order
+    formatted = StringIO()
+    write = formatted.write
+    write('{"last_update":')
+    write(dump_json(now))
+    write(',"query":')
+    write(dump_json(query_info))
+    write(',"rows":[')
+    for i, item in enumerate(items):
+        if i:
+            write(',')
+        write(dump_json(item))
+    write(']}')
+
+    return formatted.getvalue()
@@ -1,12 +1,18 @@
 from freezegun import freeze_time
-from typing import Any, Iterator, List, Tuple
+from typing import Any, Iterator, List, Optional, Tuple
 import copy
+import json
+import os
+import pathlib
 import pytest
 import re
+import subprocess
+import sys
 
 from packaging.specifiers import Specifier
 from packaging.version import Version
 
+from google.cloud.bigquery.query import ScalarQueryParameter
 from google.cloud.bigquery.schema import SchemaField
 from google.cloud.bigquery.table import RowIterator
 
@@ -27,6 +33,17 @@ ROWS = [
 ]
 
 
+def test_import_does_not_load_bigquery() -> None:
+    # Arrange
+    code = "import sys, pypinfo.cli; sys.exit('google.cloud.bigquery' in sys.modules)"
+
+    # Act
+    result = subprocess.run([sys.executable, "-c", code])
+
+    # Assert
+    assert result.returncode == 0
+
+
 def test_create_config() -> None:
     # Act
     config = core.create_config()
@@ -35,6 +52,39 @@ def test_create_config() -> None:
     assert not config.use_legacy_sql
 
 
+def test_create_config_query_parameters() -> None:
+    # Arrange
+    query_parameters = [ScalarQueryParameter("project", "STRING", "foo-bar")]
+
+    # Act
+    config = core.create_config(query_parameters)
+
+    # Assert
+    assert config.query_parameters == query_parameters
+
+
+def test_build_query_parameters_canonical_name() -> None:
+    # Arrange
+    query_parameters: List[ScalarQueryParameter] = []
+
+    # Act
+    core.build_query("Foo_Bar==1", [], query_parameters=query_parameters)
+
+    # Assert
+    assert query_parameters == [ScalarQueryParameter("project", "STRING", "foo-bar")]
+
+
+def test_build_query_parameters_no_project() -> None:
+    # Arrange
+    query_parameters: List[ScalarQueryParameter] = []
+
+    # Act
+    core.build_query("", [], query_parameters=query_parameters)
+
+    # Assert
+    assert query_parameters == []
+
+
 def test_normalize_dates_yyy_mm() -> None:
     # Arrange
     start_date = "2019-03"
@@ -78,7 +128,35 @@ def test_create_client_with_filename() -> None:
     assert output.project == "pypinfo-test"
 
 
-@pytest.mark.parametrize("test_input", ["-1", "2018-05-15"])
+def test_read_project_id() -> None:
+    # Arrange
+    filename = "tests/data/sample-credentials.json"
+
+    # Act
+    project = core.read_project_id(filename)
+
+    # Assert
+    assert project == "pypinfo-test"
+
+
+def test_read_project_id_file_changed(tmp_path: pathlib.Path) -> None:
+    # Arrange
+    creds_file = tmp_path / "credentials.json"
+    creds_file.write_text('{"project_id": "before"}')
+    os.utime(creds_file, (1000, 1000))
+    before = core.read_project_id(str(creds_file))
+    creds_file.write_text('{"project_id": "after"}')
+    os.utime(creds_file, (2000, 2000))
+
+    # Act
+    after = core.read_project_id(str(creds_file))
+
+    # Assert
+    assert before == "before"
+    assert after == "after"
+
+
+@pytest.mark.parametrize("test_input", ["-1", " -5", "-5 ", "-1_0", "2018-05-15"])
 def test_validate_date_valid(test_input: str) -> None:
     # Act
     valid = core.validate_date(test_input)
@@ -87,7 +165,7 @@ def test_validate_date_valid(test_input: str) -> None:
     assert valid
 
 
-@pytest.mark.parametrize("test_input", ["1", "2018-19-39", "something invalid"])
+@pytest.mark.parametrize("test_input", ["1", "-0", "-1__0", "-_1", "2018-19-39", "2018-05-15x", "something invalid"])
 def test_validate_date_invalid(test_input: str) -> None:
     # Act / Assert
     with pytest.raises(ValueError):
@@ -329,6 +407,59 @@ LIMIT 20
     assert output == expected
 
 
+def test_build_query_duplicate_fields() -> None:
+    # pypinfo --test numpy pyversion file pyversion
+    project = "numpy"
+    all_fields = [PythonVersion, File, PythonVersion]
+    start_date = "-2"
+    end_date = "-1"
+    expected = r"""
+SELECT
+  REGEXP_EXTRACT(details.python, r"^([^\.]+\.[^\.]+)") as python_version,
+  file.filename as file,
+  COUNT(*) as download_count,
+FROM `bigquery-public-data.pypi.file_downloads`
+WHERE timestamp BETWEEN TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL -2 DAY) AND TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL -1 DAY)
+  AND file.project = "numpy"
+GROUP BY
+  python_version, file
+ORDER BY
+  download_count DESC
+LIMIT 10
+        """.strip()  # noqa: E501
+
+    # Act
+    output = core.build_query(project, all_fields, start_date, end_date)
+
+    # Assert
+    assert output == expected
+
+
+def test_build_query_parameterized() -> None:
+    # pypinfo numpy
+    project = "numpy"
+    all_fields: List[Field] = []
+    expected = r"""
+SELECT
+  COUNT(*) as download_count,
+FROM `bigquery-public-data.pypi.file_downloads`
+WHERE timestamp BETWEEN TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL -31 DAY) AND TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL -1 DAY)
+  AND file.project = @project
+  AND details.installer.name = "pip"
+ORDER BY
+  download_count DESC
+LIMIT 10
+        """.strip()  # noqa: E501
+
+    # Act
+    query_parameters: List[ScalarQueryParameter] = []
+    output = core.build_query(project, all_fields, pip=True, query_parameters=query_parameters)
+
+    # Assert
+    assert output == expected
+    assert query_parameters == [ScalarQueryParameter("project", "STRING", "numpy")]
+
+
 def test_build_query_bad_end_date() -> None:
     # Arrange
     project = "pycodestyle"
@@ -394,6 +525,37 @@ def test_add_percentages() -> None:
     assert with_percentages == expected
 
 
+def test_add_percentages_no_sign() -> None:
+    # Arrange
+    rows = [
+        ['python_version', 'download_count'],
+        ['3.11', '1743'],
+        ['3.10', '249'],
+    ]
+    expected = [
+        ['python_version', 'percent', 'download_count'],
+        ['3.11', '0.88', '1743'],
+        ['3.10', '0.12', '249'],
+    ]
+
+    # Act
+    with_percentages = core.add_percentages(rows, include_sign=False)
+
+    # Assert
+    assert with_percentages == expected
+
+
+def test_add_percentages_no_rows() -> None:
+    # Arrange
+    rows = [['python_version', 'download_count']]
+
+    # Act
+    with_percentages = core.add_percentages(rows, include_sign=False)
+
+    # Assert
+    assert with_percentages == [['python_version', 'percent', 'download_count']]
+
+
 def test_add_download_total() -> None:
     # Arrange
     rows = copy.deepcopy(ROWS)
@@ -455,6 +617,96 @@ def test_tabulate_markdown() -> None:
     assert tabulated == expected
 
 
+def test_tabulate_wide_numbers() -> None:
+    # Arrange
+    rows = [
+        ['file', 'download_count'],
+        ['foo-1.0.tar.gz', '1234567890123456'],
+        ['foo-1.0-py3-none-any.whl', '12'],
+    ]
+    original = copy.deepcopy(rows)
+    expected = """\
+| file                     | download_count        |
+| ------------------------ | --------------------- |
+| foo-1.0.tar.gz           | 1,234,567,890,123,456 |
+| foo-1.0-py3-none-any.whl |                    12 |
+"""
+
+    # Act
+    tabulated = core.tabulate(rows)
+
+    # Assert
+    assert tabulated == expected
+    assert rows == original
+
+
+def test_tabulate_mixed_column() -> None:
+    # Arrange
+    rows = [
+        ['version', 'download_count'],
+        ['2020', '1500'],
+        ['2020.1', '20'],
+        ['Total', ''],
+    ]
+    expected = """\
+| version | download_count |
+| ------- | -------------- |
+| 2020    |          1,500 |
+| 2020.1  |             20 |
+| Total   |                |
+"""
+
+    # Act
+    tabulated = core.tabulate(rows)
+
+    # Assert
+    assert tabulated == expected
+
+
+@pytest.mark.parametrize("total", [False, True])
+def test_tabulate_numeric_first_column(total: bool) -> None:
+    # Arrange
+    rows = [
+        ['year', 'download_count'],
+        ['2023', '1500'],
+    ]
+    expected = """\
+| year  | download_count |
+| ----- | -------------- |
+| 2,023 |          1,500 |
+"""
+    if total:
+        rows = core.add_download_total(rows)
+        expected += "| Total |          1,500 |\n"
+
+    # Act
+    tabulated = core.tabulate(rows)
+
+    # Assert
+    assert tabulated == expected
+
+
+def test_tabulate_alignment_is_per_column() -> None:
+    # Arrange
+    rows = [
+        ['python_version', 'percent', 'download_count'],
+        ['3.11', '99.0%', '99'],
+        ['3.12', 'n/a', '1'],
+    ]
+    expected = """\
+| python_version | percent | download_count |
+| -------------- | ------: | -------------: |
+| 3.11           |   99.0% |             99 |
+| 3.12           |     n/a |              1 |
+"""
+
+    # Act
+    tabulated = core.tabulate(rows, markdown=True)
+
+    # Assert
+    assert tabulated == expected
+
+
 @freeze_time("2020-07-14 07:11:49")
 def test_format_json() -> None:
     # Arrange
@@ -507,6 +759,117 @@ def test_format_json() -> None:
     assert output == expected
 
 
+@freeze_time("2020-07-14 07:11:49")
+def test_format_json_mixed_column() -> None:
+    # Arrange
+    rows = [
+        ['version', 'download_count'],
+        ['2', '1500'],
+        ['2.0', '20'],
+    ]
+    expected = (
+        '{"last_update":"2020-07-14 07:11:49",'
+        '"query":{},'
+        '"rows":['
+        '{"download_count":1500,"version":"2"},'
+        '{"download_count":20,"version":"2.0"}]}'
+    )
+
+    # Act
+    output = core.format_json(rows, {}, None)
+
+    # Assert
+    assert output == expected
+
+
+@freeze_time("2020-07-14 07:11:49")
+@pytest.mark.parametrize("indent", [None, 2, 4])
+def test_format_json_stdlib_fallback(monkeypatch: pytest.MonkeyPatch, indent: Optional[int]) -> None:
+    # Arrange
+    rows = [
+        ['python_version', 'percent', 'download_count'],
+        ['2.7', '0.54', '587705'],
+        ['None', '2.8e-06', '3'],
+    ]
+    query_info = {'cached': True, 'bytes_processed': 0, 'bytes_billed': 0, 'estimated_cost': '0.00'}
+    expected = core.format_json(copy.deepcopy(rows), query_info, indent)
+    monkeypatch.setattr(core, "orjson", None)
+
+    # Act
+    output = core.format_json(rows, query_info, indent)
+
+    # Assert
+    assert output == expected
+
+
+@freeze_time("2020-07-14 07:11:49")
+@pytest.mark.parametrize("indent", [None, 2])
+def test_format_json_non_ascii(monkeypatch: pytest.MonkeyPatch, indent: Optional[int]) -> None:
+    # Arrange
+    rows = [
+        ['country', 'download_count'],
+        ['Réunion', '5'],
+        ['日本', '3'],
+    ]
+    output = core.format_json(copy.deepcopy(rows), {}, indent)
+    monkeypatch.setattr(core, "orjson", None)
+
+    # Act
+    fallback = core.format_json(rows, {}, indent)
+
+    # Assert
+    assert json.loads(output) == json.loads(fallback)
+    assert json.loads(output)['rows'][0]['country'] == 'Réunion'
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_dump_json_big_integer(indent: Optional[int]) -> None:
+    # Arrange
+    obj = {"h": 123456789012345678901234567890}
+
+    # Act
+    output = core.dump_json(obj, indent)
+
+    # Assert
+    assert json.loads(output) == obj
+
+
+@freeze_time("2020-07-14 07:11:49")
+def test_format_json_total_row() -> None:
+    # Arrange
+    rows = [
+        ['system', 'percent3', 'download_count'],
+        ['Linux', '3', '5'],
+        ['Total', 'None', '3'],
+    ]
+    expected = (
+        '{"last_update":"2020-07-14 07:11:49",'
+        '"query":{},'
+        '"rows":['
+        '{"download_count":5,"percent3":"3","system":"Linux"},'
+        '{"download_count":3,"percent3":"None","system":"Total"}]}'
+    )
+
+    # Act
+    output = core.format_json(rows, {}, None)
+
+    # Assert
+    assert output == expected
+
+
+@freeze_time("2020-07-14 07:11:49")
+def test_format_json_big_integer() -> None:
+    # Arrange
+    rows = [['h'], ['123456789012345678901234567890']]
+    expected = '{"last_update":"2020-07-14 07:11:49","query":{},"rows":[{"h":123456789012345678901234567890}]}'
+
+    # Act
+    output = core.format_json(rows, {}, None)
+
+    # Assert
+    assert output == expected
+
+
 def test_parse_query_result() -> None:
     data: List[Tuple[Any, ...]] = [
         ("name", "other"),